@@ -1,4 +1,7 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet
 
 from ..utils import TargetConfig
 
@@ -14,3 +17,32 @@ def target_to_df(target_config: TargetConfig) -> pd.DataFrame:
         return pd.read_parquet(location.path)
     else:
         raise Exception(f"Unsupported format: {location.format}")
+
+
+def target_to_arrow(target_config: TargetConfig) -> pa.Table:
+    """Load a pyarrow Table from a target config."""
+    location = target_config.location
+    if location is None:
+        raise Exception("Target config does not have a location")
+    if location.format == "csv":
+        return pa.csv.read_csv(location.path)
+    elif location.format == "parquet":
+        return pa.parquet.read_table(location.path)
+    else:
+        raise Exception(f"Unsupported format: {location.format}")
+
+
+def target_to_reader(target_config: TargetConfig, batch_size: int = 65536) -> pa.RecordBatchReader:
+    """Stream a target config as a pyarrow RecordBatchReader, one batch at a time."""
+    location = target_config.location
+    if location is None:
+        raise Exception("Target config does not have a location")
+    if location.format == "csv":
+        return pa.csv.open_csv(location.path)
+    elif location.format == "parquet":
+        parquet_file = pa.parquet.ParquetFile(location.path)
+        return pa.RecordBatchReader.from_batches(
+            parquet_file.schema_arrow, parquet_file.iter_batches(batch_size=batch_size)
+        )
+    else:
+        raise Exception(f"Unsupported format: {location.format}")
@@ -7,10 +7,14 @@ from . import BasePlugin
 from ..utils import SourceConfig
 from ..utils import TargetConfig
 from . import pd_utils
+import atexit
+import threading
 import traceback
 import os
 import pandas
+import pyarrow.parquet
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 # ======== GNA-COMPANY custom plugin for dbt-duckdb ========
 # - made to supports multi-source read and multi-target write
@@ -34,13 +38,12 @@ from typing import List
 #   - block auto generate table for rds. print ddl instead
 
 class Plugin(BasePlugin):
-    wp = WriterProperties(compression="ZSTD", compression_level=9)
-    
-    __rds_default_cols = [
+
+    __rds_default_cols = (
         "id BIGINT PRIMARY KEY AUTO_INCREMENT not null",
         "created TIMESTAMP DEFAULT CURRENT_TIMESTAMP null",
         "updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP null",
-    ]
+    )
     
     __rds_default_dtypes = {
         'int32': 'BIGINT',
@@ -55,29 +58,61 @@ class Plugin(BasePlugin):
         'datetime.date': 'DATE',
         'datetime.datetime': 'DATETIME'
     }
-    
+
+    __rds_insert_batch_rows = 10000
+
     
     
     def initialize(self, plugin_config: Dict[str, Any])->None:
         self.plugin_config = plugin_config
-            
+        # zstd level 3 is close to level 9 in size but several times cheaper in cpu;
+        # row group / page sizing follows the delta writer defaults for s3 scans
+        self.wp = WriterProperties(
+            compression="ZSTD",
+            compression_level=plugin_config.get("compression_level", 3),
+            data_page_size_limit=plugin_config.get("data_page_size_limit", 1 << 20),
+            max_row_group_size=plugin_config.get("max_row_group_size", 1_000_000),
+        )
+        self.__delta_opt_cache = {}
+        self.__rds_opt_cache = {}
+        self.__delta_table_cache = {}
+        # the deltalake bindings are not thread-safe on a shared handle
+        self.__delta_load_lock = threading.Lock()
+        self.__write_pool = None
+        self.__write_futures = []
+        # store runs on dbt's worker threads against this shared instance
+        self.__write_lock = threading.Lock()
+        self.__configured_conn = None
+
     def configure_connection(self, conn: DuckDBPyConnection)->None:
-        self.conn = conn        
-        
+        # re-registering the UDF on an already configured connection hits
+        # catalog locking for nothing; only a new connection needs setup
+        if conn is self.__configured_conn:
+            return
+        self.conn = conn
+        # attaches live on the connection, so a fresh connection starts clean
+        self.__rds_alias_cache = {}
+        self.__rds_attach_lock = threading.Lock()
+        self.__current_use = None
+
         def current_datetime_local(fmt:str, days:int=0)->str:
             return (datetime.datetime.now() + datetime.timedelta(days=days)).strftime(fmt)
-        
+
         self.conn.create_function(name="current_datetime_local", function=current_datetime_local)
-        
+        self.__configured_conn = conn
+
     def __delta_conn_opt(self, region:str, storage:str)->Dict[str, str]:
+        cached = self.__delta_opt_cache.get((region, storage))
+        if cached is not None:
+            return cached
         __opt = self.plugin_config[region][storage]
-        
+
         host = __opt.get("host")
         port = __opt.get("port")
         access_key = __opt.get("access_key")
         secret_key = __opt.get("secret_key")
         region_str = __opt.get("s3_region", "")
-        return {
+        opt = {
             "aws_endpoint": f"http://{host}:{port}",
             "aws_access_key_id": access_key,
             "aws_secret_access_key": secret_key,
@@ -87,65 +122,87 @@ class Plugin(BasePlugin):
             "AWS_S3_ALLOW_UNSAFE_RENAME": "True",
             "AWS_STORAGE_ALLOW_HTTP": "True",
         }
-        
+        self.__delta_opt_cache[(region, storage)] = opt
+        return opt
+
     def __rds_conn_opt(self, region:str, storage:str)->Dict[str, str]:
+        cached = self.__rds_opt_cache.get((region, storage))
+        if cached is not None:
+            return cached
         __opt = self.plugin_config[region][storage]
-        
+
         host = __opt.get("host")
         port = __opt.get("port")
         user = __opt.get("user")
         password = __opt.get("password")
-        
-        return {
+
+        opt = {
             "host": host,
             "port": port,
             "user": user,
             "password": password,
         }
+        self.__rds_opt_cache[(region, storage)] = opt
+        return opt
 
     def __attach_to_rds(self, storage_options:Dict, scheme:str, table_name:str)->str:
         h = storage_options.get("host")
         u = storage_options.get("user")
         p = storage_options.get("port")
         pwd = storage_options.get("password")
-        db_alias = f"{scheme}_{table_name}"     
-        self.conn.execute(
-            f"ATTACH 'host={h} user={u} port={p} password={pwd} database={scheme}' AS {db_alias} (TYPE MYSQL);"
-        )
-        self.conn.execute(f"USE {db_alias};")   
-        print(f"connected to rds: {table_name}.{scheme}")
+        # serialized so parallel models cannot race the cache check into a
+        # duplicate ATTACH (a binder error) or interleave the USE tracking
+        with self.__rds_attach_lock:
+            db_alias = self.__rds_alias_cache.get((h, p, scheme))
+            if db_alias is None:
+                db_alias = f"{scheme}_{len(self.__rds_alias_cache)}"
+                self.conn.execute(
+                    f"ATTACH 'host={h} user={u} port={p} password={pwd} database={scheme}' AS {db_alias} (TYPE MYSQL);"
+                )
+                self.__rds_alias_cache[(h, p, scheme)] = db_alias
+                print(f"connected to rds: {scheme} as {db_alias}")
+            if self.__current_use != db_alias:
+                self.conn.execute(f"USE {db_alias};")
+                self.__current_use = db_alias
         return db_alias
     
     
     def __create_table_if_needed(self, scheme:str, table_name:str, db_alias:str, df:pandas.DataFrame, uniq_cols:List[str]|str=None, index_cols:List[str]|str=None)->str:
         
         info_q = f"""
-                select TABLE_NAME 
-                from INFORMATION_SCHEMA.TABLES 
-                where TABLE_SCHEMA = ''{scheme}'' and TABLE_NAME = ''{table_name}'';            
+            select 1 from mysql_query('{db_alias}',
+                'select 1 from information_schema.tables
+                 where table_schema = ''{scheme}'' and table_name = ''{table_name}''
+                 limit 1');
         """
-        info_q = f"""
-            select * from mysql_query('{db_alias}', '{info_q}');
-        """
-        
-        if len(self.conn.execute(info_q).fetchall()) == 0:
+
+        if self.conn.execute(info_q).fetchone() is None:
             print(f"table {scheme}.{table_name} does not exist, creating...")
-            ddl_cols = self.__rds_default_cols
+            ddl_cols = list(self.__rds_default_cols)
             for column, dtype in zip(df.columns, df.dtypes):
+                dtype_str = str(dtype)
                 if pandas.api.types.is_datetime64_any_dtype(dtype):
                     mysql_type = self.__rds_default_dtypes['datetime64[ns]']
-                elif isinstance(df[column].iloc[0], datetime.date):
-                    mysql_type = self.__rds_default_dtypes['datetime.date']
-                elif isinstance(df[column].iloc[0], datetime.datetime):
-                    mysql_type = self.__rds_default_dtypes['datetime.datetime']
-                elif pandas.api.types.is_integer_dtype(dtype):
-                    mysql_type = self.__rds_default_dtypes['int64']
-                elif pandas.api.types.is_float_dtype(dtype):
-                    mysql_type = self.__rds_default_dtypes['float64']
+                elif dtype_str != 'object' and dtype_str in self.__rds_default_dtypes:
+                    mysql_type = self.__rds_default_dtypes[dtype_str]
                 else:
-                    max_data_len = df[column].apply(lambda x: len(str(x))).max() * 2
-                    
-                    mysql_type = f'VARCHAR({str(max_data_len)})'
+                    # object columns: infer_dtype scans the column in C instead
+                    # of probing .iloc[0], and does not break on empty frames
+                    inferred = pandas.api.types.infer_dtype(df[column], skipna=True)
+                    if inferred == 'date':
+                        mysql_type = self.__rds_default_dtypes['datetime.date']
+                    elif inferred == 'datetime':
+                        mysql_type = self.__rds_default_dtypes['datetime.datetime']
+                    elif inferred == 'integer':
+                        mysql_type = self.__rds_default_dtypes['int64']
+                    elif inferred in ('floating', 'mixed-integer-float'):
+                        mysql_type = self.__rds_default_dtypes['float64']
+                    else:
+                        max_data_len = df[column].astype(str).str.len().max() * 2
+                        if pandas.isna(max_data_len):
+                            mysql_type = self.__rds_default_dtypes['object']
+                        else:
+                            mysql_type = f'VARCHAR({str(max_data_len)})'
 
                 _col_ddl = f"  {column} {mysql_type}"
                 ddl_cols.append(_col_ddl)
@@ -195,26 +252,88 @@ CREATE TABLE {scheme}.{table_name} (
             return None
                     
         
+    def __submit_write(self, fn)->None:
+        # parallel writes are opt-in: without parallel_writes in the plugin
+        # config each write runs synchronously, so a failure fails its own
+        # model. With a pool, a failure only surfaces on a later store call
+        # or at the atexit drain, which cannot fail the dbt run anymore.
+        if self.plugin_config.get("parallel_writes") is None:
+            fn()
+            return
+        self.__reap_write_futures()
+        with self.__write_lock:
+            if self.__write_pool is None:
+                self.__write_pool = ThreadPoolExecutor(
+                    max_workers=self.plugin_config["parallel_writes"]
+                )
+                atexit.register(self.__reap_write_futures, True)
+            self.__write_futures.append(self.__write_pool.submit(fn))
+
+
+    def __reap_write_futures(self, wait:bool=False)->None:
+        pending = []
+        try:
+            while True:
+                with self.__write_lock:
+                    if not self.__write_futures:
+                        break
+                    future = self.__write_futures.pop()
+                if wait or future.done():
+                    future.result()
+                else:
+                    pending.append(future)
+        finally:
+            with self.__write_lock:
+                self.__write_futures.extend(pending)
+
+
+    def __build_insert_rows(self, df:pandas.DataFrame)->List[str]:
+        str_df = df.astype(str)
+        for column in df.columns:
+            # a quote in a value must be escaped twice: once for the mysql
+            # literal and once more for the duckdb string wrapping the CALL
+            str_df[column] = str_df[column].str.replace("'", "''''", regex=False)
+        quoted = ("''" + str_df + "''").mask(df.isna(), "NULL")
+        joined = quoted[df.columns[0]]
+        for column in df.columns[1:]:
+            joined = joined + ", " + quoted[column]
+        return joined.tolist()
+
+
+    def __build_insert_batches(self, rows:List[str], batch_rows:int)->List[str]:
+        return [
+            "(" + "), (".join(rows[start:start + batch_rows]) + ")"
+            for start in range(0, len(rows), batch_rows)
+        ]
+
+
     def load(self, source_config: SourceConfig)->Any:
         print(f"loading source_config: {source_config}")
         storage = source_config.get("storage")
         region = source_config.get("region")
         if storage is None or region is None:
             raise Exception("storage and region are required arguments")
-        storage_type = self.plugin_config[region][storage].get("type")
-        
-        if storage_type == "delta":        
+        conf = self.plugin_config[region][storage]
+        storage_type = conf.get("type")
+
+        if storage_type == "delta":
             storage_options = self.__delta_conn_opt(region, storage)
             if "delta_table_path" not in source_config:
                 raise Exception("'delta_table_path' is a required argument for the delta table")
             table_path = source_config["delta_table_path"]
             print(f"loading from minio deltalake table: {region}.{storage}.{table_path}")
-            if storage_options:
-                dt = DeltaTable(table_path, storage_options=storage_options)
-            else:
-                dt = DeltaTable(table_path)
+            with self.__delta_load_lock:
+                dt = self.__delta_table_cache.get((region, storage, table_path))
+                if dt is not None:
+                    dt.update_incremental()
+                else:
+                    if storage_options:
+                        dt = DeltaTable(table_path, storage_options=storage_options)
+                    else:
+                        dt = DeltaTable(table_path)
+                    self.__delta_table_cache[(region, storage, table_path)] = dt
 
-            df = dt.to_pyarrow_dataset()
+                df = dt.to_pyarrow_dataset()
             return df
         
         elif storage_type == "rds":
@@ -237,9 +356,10 @@ CREATE TABLE {scheme}.{table_name} (
         
         region = target_config.config.get("region")
         storage = target_config.config.get("storage")
-        storage_type = self.plugin_config[region][storage].get("type")
         if storage is None or region is None:
             raise Exception("storage and region are required arguments")
+        conf = self.plugin_config[region][storage]
+        storage_type = conf.get("type")
         
         if storage_type == "delta":        
             storage_options = self.__delta_conn_opt(region, storage)
@@ -250,28 +370,37 @@ CREATE TABLE {scheme}.{table_name} (
             if not bucket or not dataset_name:
                 raise Exception(f"bucket: {bucket} and dataset_name: {dataset_name} are both required")
             print(f"storing to minio: {region}.{storage} s3://{bucket}/{dataset_name}")
-            df = pd_utils.target_to_df(target_config)
-            print(f"df:\n{df}")
-            try:
-                write_deltalake(
-                    f"s3://{bucket}/{dataset_name}",
-                    data=df,
-                    schema=None,
-                    partition_by=partition_col,
-                    name=dataset_name,
-                    description="",
-                    storage_options=storage_options,
-                    mode="append",
-                    writer_properties=self.wp,
-                    engine="rust",
-                    custom_metadata=None,
-                )
-                print(f"saved to minio: {region}.{storage} s3://{bucket}/{dataset_name}")
-            except Exception:
-                msg = f"Failed to save datasource {traceback.format_exc()}"
-                print(msg)
-                raise Exception(msg)
-            
+            data = pd_utils.target_to_reader(target_config)
+            print(f"data schema:\n{data.schema}")
+
+            def _write()->None:
+                try:
+                    write_deltalake(
+                        f"s3://{bucket}/{dataset_name}",
+                        data=data,
+                        schema=data.schema,
+                        partition_by=partition_col,
+                        name=dataset_name,
+                        description="",
+                        storage_options=storage_options,
+                        mode="append",
+                        writer_properties=self.wp,
+                        engine="rust",
+                        custom_metadata=None,
+                        # plain string batches panic in the rust writer when
+                        # streamed over the arrow C interface; large offsets are safe
+                        large_dtypes=True,
+                    )
+                    print(f"saved to minio: {region}.{storage} s3://{bucket}/{dataset_name}")
+                except Exception:
+                    msg = f"Failed to save datasource {traceback.format_exc()}"
+                    print(msg)
+                    raise Exception(msg)
+
+            # the rust writer releases the GIL, so with parallel_writes set the
+            # writes for independent models can overlap
+            self.__submit_write(_write)
+
         elif storage_type == "rds":
             scheme = target_config.config.get("scheme")
             table_name = target_config.config.get("table")
@@ -294,46 +423,60 @@ CREATE TABLE {scheme}.{table_name} (
             
             cols = df.columns
             col_str = ", ".join(cols)
-            
-            vals = []
-            for _,row in df.iterrows():
-                vals_str = ", ".join([f"NULL" if v is None else f"''{v}''" for v in row])
-                vals.append(f"({vals_str})")
-            
-            q = f"""
-                insert into
-                {scheme}.{table_name}
-                ({col_str})
-                values
-                {", ".join(vals)}
-                on duplicate key update
-                {", ".join([f"{c}=values({c})" for c in cols])}
-            """
-                        
-            q = f"""
-            CALL mysql_execute('{db_alias}', '{q}');
-            """
-            
-            self.conn.execute(q)
+            update_str = ", ".join([f"{c}=values({c})" for c in cols])
+            batch_rows = target_config.config.get("insert_batch_rows", self.__rds_insert_batch_rows)
+            rows = self.__build_insert_rows(df)
+            batches = self.__build_insert_batches(rows, batch_rows)
+
+            for i, vals_str in enumerate(batches):
+                q = f"""
+                    insert into
+                    {scheme}.{table_name}
+                    ({col_str})
+                    values
+                    {vals_str}
+                    on duplicate key update
+                    {update_str}
+                """
+
+                q = f"""
+                CALL mysql_execute('{db_alias}', '{q}');
+                """
+
+                self.conn.execute(q)
+                print(f"inserted to rds table: {scheme}.{table_name}, batch {i + 1}/{len(batches)}")
             print(f"inserted to rds table: {scheme}.{table_name}, row count: {len(df)}")
             
         elif storage_type == "local":
-            df = pd_utils.target_to_df(target_config)
-            print(f"df:\n{df}")
-            root = self.plugin_config[region][storage].get("root")
+            root = conf.get("root")
             path = target_config.config.get("file_name")
             path = os.path.join(root, path)
             if path.endswith(".csv"):
-                if os.path.exists(path):
-                    os.remove(path)
-                df.to_csv(path, index=False)
+                df = pd_utils.target_to_df(target_config)
+                print(f"df:\n{df}")
+
+                def _write()->None:
+                    df.to_csv(path, index=False)
+                    print(f"saved to local path: {path}")
+
             elif path.endswith(".parquet"):
-                if os.path.exists(path):
-                    os.remove(path)
-                df.to_parquet(path, index=False)
+                data = pd_utils.target_to_arrow(target_config)
+                print(f"data schema:\n{data.schema}")
+
+                def _write()->None:
+                    pyarrow.parquet.write_table(
+                        data,
+                        path,
+                        compression="zstd",
+                        compression_level=3,
+                        data_page_size=1 << 20,
+                        row_group_size=1_000_000,
+                    )
+                    print(f"saved to local path: {path}")
+
             else:
                 raise Exception(f"Unsupported format: {path}")
-            print(f"saved to local path: {path}")
+            self.__submit_write(_write)
             
         elif storage_type == "ref":
             df = pd_utils.target_to_df(target_config)
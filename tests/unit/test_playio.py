@@ -0,0 +1,93 @@
+import pandas as pd
+import pytest
+
+from dbt.adapters.duckdb.plugins import pd_utils
+from dbt.adapters.duckdb.plugins.playio import Plugin
+from dbt.adapters.duckdb.utils import TargetConfig
+from dbt.adapters.duckdb.utils import TargetLocation
+
+
+@pytest.fixture
+def plugin():
+    return Plugin(name="playio", plugin_config={})
+
+
+def test_build_insert_rows_quotes_values(plugin):
+    df = pd.DataFrame({"i": [1, 2], "s": ["plain", "text"]})
+    rows = plugin._Plugin__build_insert_rows(df)
+    assert rows == ["''1'', ''plain''", "''2'', ''text''"]
+
+
+def test_build_insert_rows_escapes_quotes(plugin):
+    # one escape for the mysql literal, one for the duckdb CALL string
+    df = pd.DataFrame({"s": ["o'brien", "it's"]})
+    rows = plugin._Plugin__build_insert_rows(df)
+    assert rows == ["''o''''brien''", "''it''''s''"]
+
+
+def test_build_insert_rows_masks_missing_as_null(plugin):
+    df = pd.DataFrame(
+        {
+            "f": [1.5, None],
+            "s": ["x", None],
+            "ts": pd.to_datetime(["2024-01-01 12:00:00", None]),
+        }
+    )
+    rows = plugin._Plugin__build_insert_rows(df)
+    assert rows == ["''1.5'', ''x'', ''2024-01-01 12:00:00''", "NULL, NULL, NULL"]
+
+
+def test_build_insert_rows_empty_frame(plugin):
+    df = pd.DataFrame({"a": [], "b": []})
+    assert plugin._Plugin__build_insert_rows(df) == []
+
+
+def test_build_insert_batches(plugin):
+    rows = ["r1", "r2", "r3", "r4", "r5"]
+    batches = plugin._Plugin__build_insert_batches(rows, 2)
+    assert batches == ["(r1), (r2)", "(r3), (r4)", "(r5)"]
+
+
+def test_build_insert_batches_single_batch(plugin):
+    rows = ["r1", "r2"]
+    assert plugin._Plugin__build_insert_batches(rows, 1000) == ["(r1), (r2)"]
+    assert plugin._Plugin__build_insert_batches([], 1000) == []
+
+
+def _target_config(path: str, format: str) -> TargetConfig:
+    return TargetConfig(
+        relation=None,
+        column_list=[],
+        config={},
+        location=TargetLocation(path=path, format=format),
+    )
+
+
+def test_target_to_arrow_parquet(tmp_path):
+    path = str(tmp_path / "t.parquet")
+    pd.DataFrame({"a": [1, 2], "b": ["x", "y"]}).to_parquet(path, index=False)
+    table = pd_utils.target_to_arrow(_target_config(path, "parquet"))
+    assert table.column_names == ["a", "b"]
+    assert table.num_rows == 2
+
+
+def test_target_to_arrow_csv(tmp_path):
+    path = str(tmp_path / "t.csv")
+    pd.DataFrame({"a": [1, 2], "b": ["x", "y"]}).to_csv(path, index=False)
+    table = pd_utils.target_to_arrow(_target_config(path, "csv"))
+    assert table.column_names == ["a", "b"]
+    assert table.num_rows == 2
+
+
+def test_target_to_reader_parquet_batches(tmp_path):
+    path = str(tmp_path / "t.parquet")
+    pd.DataFrame({"a": range(10), "b": ["x"] * 10}).to_parquet(path, index=False)
+    reader = pd_utils.target_to_reader(_target_config(path, "parquet"), batch_size=4)
+    batches = list(reader)
+    assert [b.num_rows for b in batches] == [4, 4, 2]
+    assert batches[0].schema.names == ["a", "b"]
+
+
+def test_target_to_reader_unsupported_format(tmp_path):
+    with pytest.raises(Exception, match="Unsupported format"):
+        pd_utils.target_to_reader(_target_config(str(tmp_path / "t.json"), "json"))